@@ -4,18 +4,41 @@
 from __future__ import annotations
 
 import argparse
-import datetime as dt
+import concurrent.futures
+import functools
 import hashlib
+import io
 import json
+import mmap
 import os
-import re
 import shutil
+import string
 import subprocess
 import sys
 import time
 import urllib.error
 import urllib.request
 from pathlib import Path
+from typing import Protocol
+
+if sys.version_info < (3, 11):
+    print("ERROR: Python 3.11+ is required (hashlib.file_digest)", file=sys.stderr)
+    raise SystemExit(1)
+
+try:
+    import blake3
+except ModuleNotFoundError:
+    blake3 = None
+
+try:
+    import httpx
+except ModuleNotFoundError:
+    httpx = None
+
+try:
+    import orjson
+except ModuleNotFoundError:
+    orjson = None
 
 ROOT = Path(__file__).resolve().parents[2]
 DEFAULT_SOURCE_DIR = ROOT / ".homebrew"
@@ -23,8 +46,12 @@ DEFAULT_SOURCE_REPO = "smorinlabs/envgen"
 DEFAULT_TAP_REPO = "smorinlabs/homebrew-tap"
 DEFAULT_TAP_REPO_DIR = Path("/Users/stevemorin/c/homebrew-tap")
 DEFAULT_TAP_FORMULA = "Formula/envgen.rb"
-DOWNLOAD_CHUNK_SIZE = 1024 * 1024
-TAG_PATTERN = re.compile(r"^v(\d+\.\d+\.\d+)(?:[.-].*)?$")
+DOWNLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+MMAP_HASH_MIN_SIZE = 1024 * 1024
+DOWNLOAD_HEADERS = {
+    "Accept-Encoding": "identity",
+    "User-Agent": "envgen-homebrew-tap-release/1.0",
+}
 TRUTHY_ENV_VALUES = {"1", "true", "yes", "on"}
 FALSY_ENV_VALUES = {"", "0", "false", "no", "off"}
 NEXT_STEP_STAGES = (
@@ -43,6 +70,10 @@ def fail(message: str) -> None:
     raise TapReleaseError(message)
 
 
+class RangeRequestIgnored(RuntimeError):
+    """Raised when a ranged GET comes back as a full 200 response."""
+
+
 def env_var_truthy(name: str) -> bool:
     value = os.environ.get(name)
     if value is None:
@@ -73,14 +104,34 @@ def hints_enabled() -> bool:
 
 
 def parse_tag(tag: str) -> str:
-    match = TAG_PATTERN.fullmatch(tag.strip())
-    if not match:
-        fail(f"Invalid tag '{tag}'. Expected vX.Y.Z")
-    return match.group(1)
+    candidate = tag.strip()
+    if candidate.startswith("v") and "\n" not in candidate:
+        major, _, rest = candidate[1:].partition(".")
+        minor, _, rest = rest.partition(".")
+        patch_end = 0
+        while patch_end < len(rest) and rest[patch_end].isdecimal():
+            patch_end += 1
+        patch, suffix = rest[:patch_end], rest[patch_end:]
+        if major.isdecimal() and minor.isdecimal() and patch and suffix[:1] in ("", ".", "-"):
+            return f"{major}.{minor}.{patch}"
+    fail(f"Invalid tag '{tag}'. Expected vX.Y.Z")
+
+
+class FilenameSanitizeTable(dict[int, int]):
+    """str.translate table that maps every code point it does not list to '_'."""
+
+    def __missing__(self, codepoint: int) -> int:
+        return ord("_")
+
+
+FILENAME_SAFE_TABLE = FilenameSanitizeTable(
+    (ord(char), ord(char))
+    for char in string.ascii_letters + string.digits + "._-"
+)
 
 
 def sanitized_tag_for_filename(tag: str) -> str:
-    return re.sub(r"[^A-Za-z0-9._-]", "_", tag)
+    return tag.translate(FILENAME_SAFE_TABLE)
 
 
 def default_source_json_path(tag: str) -> Path:
@@ -101,31 +152,266 @@ def tap_repo_to_tap_name(tap_repo: str) -> str:
     return f"{owner}/{repo}"
 
 
+def download_request(
+    url: str,
+    *,
+    method: str = "GET",
+    byte_range: str | None = None,
+    if_range: str | None = None,
+) -> urllib.request.Request:
+    headers = dict(DOWNLOAD_HEADERS)
+    if byte_range is not None:
+        headers["Range"] = f"bytes={byte_range}"
+    if if_range is not None:
+        headers["If-Range"] = if_range
+    return urllib.request.Request(url, headers=headers, method=method)
+
+
+class Digest(Protocol):
+    def update(self, data: bytes, /) -> None: ...
+
+    def hexdigest(self) -> str: ...
+
+
+class DigestingWriter:
+    """File-like sink that hashes every chunk before writing it through.
+
+    SHA-256 is always computed because the Homebrew formula pins it; BLAKE3 is
+    added when the optional ``blake3`` package is installed.
+    """
+
+    def __init__(self, output_file: io.BufferedIOBase) -> None:
+        self.output_file = output_file
+        self.digests: dict[str, Digest] = {"sha256": hashlib.sha256()}
+        if blake3 is not None:
+            self.digests["blake3"] = blake3.blake3()
+        self.size = 0
+
+    def write(self, chunk: bytes) -> int:
+        for digest in self.digests.values():
+            digest.update(chunk)
+        self.size += len(chunk)
+        return self.output_file.write(chunk)
+
+    def hexdigests(self) -> dict[str, str]:
+        return {name: digest.hexdigest() for name, digest in self.digests.items()}
+
+
+def copy_and_hash(source: io.BufferedIOBase, writer: DigestingWriter) -> None:
+    shutil.copyfileobj(source, writer, DOWNLOAD_CHUNK_SIZE)
+
+
+@functools.cache
+def http_client() -> httpx.Client | None:
+    if httpx is None:
+        return None
+    limits = httpx.Limits(max_keepalive_connections=8)
+    try:
+        return httpx.Client(
+            http2=True,
+            timeout=60,
+            limits=limits,
+            follow_redirects=True,
+            headers=DOWNLOAD_HEADERS,
+        )
+    except ImportError:
+        # httpx raises ImportError for http2=True when the h2 extra is missing.
+        return httpx.Client(
+            timeout=60,
+            limits=limits,
+            follow_redirects=True,
+            headers=DOWNLOAD_HEADERS,
+        )
+
+
+def download_single_stream(
+    *,
+    url: str,
+    destination: Path,
+) -> tuple[str, int, dict[str, str], str | None]:
+    client = http_client()
+    if client is not None:
+        with client.stream("GET", url) as response:
+            response.raise_for_status()
+            final_url = str(response.url)
+            etag = response.headers.get("ETag")
+            with destination.open("wb") as output_file:
+                writer = DigestingWriter(output_file)
+                for chunk in response.iter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    writer.write(chunk)
+        return final_url, writer.size, writer.hexdigests(), etag
+
+    with urllib.request.urlopen(download_request(url), timeout=60) as response:
+        final_url = response.geturl()
+        etag = response.headers.get("ETag")
+        reader = io.BufferedReader(response, buffer_size=DOWNLOAD_CHUNK_SIZE)
+        with destination.open("wb") as output_file:
+            writer = DigestingWriter(output_file)
+            copy_and_hash(reader, writer)
+    return final_url, writer.size, writer.hexdigests(), etag
+
+
+def probe_range_support(url: str) -> tuple[str, int, str | None] | None:
+    request = download_request(url, method="HEAD")
+    with urllib.request.urlopen(request, timeout=60) as response:
+        final_url = response.geturl()
+        etag = response.headers.get("ETag")
+        accept_ranges = response.headers.get("Accept-Ranges", "")
+        content_length = response.headers.get("Content-Length")
+    if accept_ranges.strip().lower() != "bytes" or not content_length:
+        return None
+    # Ranged parts are tied to one version of the file via If-Range, which
+    # only accepts a strong validator.
+    if not etag or etag.startswith("W/"):
+        return None
+    try:
+        total_size = int(content_length)
+    except ValueError:
+        return None
+    if total_size <= 0:
+        return None
+    return final_url, total_size, etag
+
+
+def source_cache_is_current(
+    *,
+    url: str,
+    download_path: Path,
+    cached: dict[str, object],
+) -> bool:
+    etag = cached.get("etag")
+    if not etag:
+        return False
+    try:
+        stat = download_path.stat()
+    except FileNotFoundError:
+        return False
+    if stat.st_size != cached.get("size_bytes") or stat.st_mtime_ns != cached.get("mtime_ns"):
+        return False
+
+    request = download_request(url, method="HEAD")
+    request.add_header("If-None-Match", str(etag))
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return response.headers.get("ETag") == etag
+    except urllib.error.HTTPError as exc:
+        return exc.code == 304
+    except (urllib.error.URLError, OSError):
+        return False
+
+
+def download_range(
+    *,
+    url: str,
+    destination: Path,
+    start: int,
+    end: int,
+    total_size: int,
+    etag: str,
+) -> None:
+    request = download_request(url, byte_range=f"{start}-{end}", if_range=etag)
+    with urllib.request.urlopen(request, timeout=60) as response:
+        if response.status == 200:
+            raise RangeRequestIgnored(
+                f"range {start}-{end} answered with a full 200 response"
+            )
+        if response.status != 206:
+            raise RuntimeError(
+                f"expected 206 Partial Content for range {start}-{end}, "
+                f"got {response.status}"
+            )
+        content_range = response.headers.get("Content-Range", "")
+        expected_range = f"bytes {start}-{end}/{total_size}"
+        if content_range.strip() != expected_range:
+            raise RuntimeError(
+                f"expected Content-Range '{expected_range}', got '{content_range}'"
+            )
+        reader = io.BufferedReader(response, buffer_size=DOWNLOAD_CHUNK_SIZE)
+        with destination.open("wb") as output_file:
+            shutil.copyfileobj(reader, output_file, DOWNLOAD_CHUNK_SIZE)
+    expected = end - start + 1
+    actual = destination.stat().st_size
+    if actual != expected:
+        raise RuntimeError(f"range {start}-{end} returned {actual} bytes, expected {expected}")
+
+
+def download_ranges_parallel(
+    *,
+    url: str,
+    destination: Path,
+    total_size: int,
+    etag: str,
+    parallel: int,
+) -> tuple[int, dict[str, str]]:
+    part_size = -(-total_size // parallel)
+    ranges = [
+        (start, min(start + part_size, total_size) - 1)
+        for start in range(0, total_size, part_size)
+    ]
+    part_paths = [
+        destination.with_name(f"{destination.name}.part{index}")
+        for index in range(len(ranges))
+    ]
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            futures = [
+                executor.submit(
+                    download_range,
+                    url=url,
+                    destination=part_path,
+                    start=start,
+                    end=end,
+                    total_size=total_size,
+                    etag=etag,
+                )
+                for part_path, (start, end) in zip(part_paths, ranges)
+            ]
+            for future in futures:
+                future.result()
+
+        with destination.open("wb") as output_file:
+            writer = DigestingWriter(output_file)
+            for part_path in part_paths:
+                with part_path.open("rb") as part_file:
+                    copy_and_hash(part_file, writer)
+    finally:
+        for part_path in part_paths:
+            part_path.unlink(missing_ok=True)
+
+    return writer.size, writer.hexdigests()
+
+
 def download_tarball_with_retries(
     *,
     url: str,
     destination: Path,
     attempts: int,
     sleep_seconds: float,
-) -> tuple[str, int]:
+    parallel: int = 1,
+) -> tuple[str, int, dict[str, str], str | None]:
     destination.parent.mkdir(parents=True, exist_ok=True)
 
     last_error: Exception | None = None
     for attempt in range(1, attempts + 1):
         try:
-            request = urllib.request.Request(
-                url,
-                headers={"User-Agent": "envgen-homebrew-tap-release/1.0"},
-            )
-            with urllib.request.urlopen(request, timeout=60) as response:
-                final_url = response.geturl()
-                with destination.open("wb") as output_file:
-                    while True:
-                        chunk = response.read(DOWNLOAD_CHUNK_SIZE)
-                        if not chunk:
-                            break
-                        output_file.write(chunk)
-            return final_url, destination.stat().st_size
+            if parallel > 1:
+                probe = probe_range_support(url)
+                if probe is not None:
+                    final_url, total_size, etag = probe
+                    try:
+                        size, digests = download_ranges_parallel(
+                            url=final_url,
+                            destination=destination,
+                            total_size=total_size,
+                            etag=etag,
+                            parallel=parallel,
+                        )
+                    except RangeRequestIgnored:
+                        pass
+                    else:
+                        return final_url, size, digests, etag
+            return download_single_stream(url=url, destination=destination)
         except Exception as exc:  # noqa: BLE001
             last_error = exc
             if attempt == attempts:
@@ -140,18 +426,60 @@ def download_tarball_with_retries(
 
 
 def sha256_file(path: Path) -> str:
-    digest = hashlib.sha256()
-    with path.open("rb") as input_file:
-        for chunk in iter(lambda: input_file.read(DOWNLOAD_CHUNK_SIZE), b""):
-            digest.update(chunk)
+    with path.open("rb", buffering=0) as input_file:
+        size = os.fstat(input_file.fileno()).st_size
+        if size < MMAP_HASH_MIN_SIZE or not hasattr(mmap, "MADV_SEQUENTIAL"):
+            return hashlib.file_digest(input_file, "sha256").hexdigest()
+        with mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+            return hashlib.sha256(mapped).hexdigest()
+
+
+def blake3_file(path: Path) -> str:
+    digest = blake3.blake3(max_threads=blake3.blake3.AUTO)
+    digest.update_mmap(path)
     return digest.hexdigest()
 
 
+def dump_json_bytes(data: dict[str, object]) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_SORT_KEYS | orjson.OPT_INDENT_2) + b"\n"
+    return (json.dumps(data, indent=2, sort_keys=True) + "\n").encode("utf-8")
+
+
+def load_json_bytes(raw: bytes) -> object:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
 def write_json_atomic(path: Path, data: dict[str, object]) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
     tmp_path = path.with_suffix(path.suffix + ".tmp")
-    tmp_path.write_text(json.dumps(data, indent=2, sort_keys=True) + "\n", encoding="utf-8")
-    tmp_path.replace(path)
+    content = dump_json_bytes(data)
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(content)
+        while view:
+            view = view[os.write(fd, view) :]
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(tmp_path, path)
+
+    dir_fd = os.open(path.parent, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def read_cached_source_metadata(path: Path) -> dict[str, object] | None:
+    try:
+        raw = load_json_bytes(path.read_bytes())
+    except (OSError, json.JSONDecodeError):
+        return None
+    return raw if isinstance(raw, dict) else None
 
 
 def read_source_metadata(path: Path) -> dict[str, object]:
@@ -161,7 +489,7 @@ def read_source_metadata(path: Path) -> dict[str, object]:
             f"{path}. Run `make homebrew-source TAG=vX.Y.Z` first."
         )
     try:
-        raw = json.loads(path.read_text(encoding="utf-8"))
+        raw = load_json_bytes(path.read_bytes())
     except json.JSONDecodeError as exc:
         fail(f"Failed to parse source metadata JSON {path}: {exc}")
 
@@ -178,46 +506,51 @@ def read_source_metadata(path: Path) -> dict[str, object]:
     return raw
 
 
-def formula_template(*, source_url: str, sha256: str) -> str:
-    return f"""class Envgen < Formula
-  desc \"Generate .env files from declarative YAML schemas\"
-  homepage \"https://github.com/smorinlabs/envgen\"
-  url \"{source_url}\"
-  sha256 \"{sha256}\"
-  license \"MIT\"
-  head \"https://github.com/smorinlabs/envgen.git\", branch: \"main\"
+FORMULA_TEMPLATE = string.Template(
+    """class Envgen < Formula
+  desc "Generate .env files from declarative YAML schemas"
+  homepage "https://github.com/smorinlabs/envgen"
+  url "$url"
+  sha256 "$sha256"
+  license "MIT"
+  head "https://github.com/smorinlabs/envgen.git", branch: "main"
 
-  depends_on \"rust\" => :build
+  depends_on "rust" => :build
 
   def install
-    system \"cargo\", \"install\", *std_cargo_args
+    system "cargo", "install", *std_cargo_args
   end
 
   test do
-    (testpath/\"envgen.yaml\").write <<~YAML
-      schema_version: \"2\"
+    (testpath/"envgen.yaml").write <<~YAML
+      schema_version: "2"
       metadata:
-        description: \"Homebrew test schema\"
+        description: "Homebrew test schema"
         destination:
-          local: \".env.local\"
+          local: ".env.local"
       environments:
-        local: {{}}
-      sources: {{}}
+        local: {}
+      sources: {}
       variables:
         APP_NAME:
-          description: \"App name\"
+          description: "App name"
           source: static
           values:
-            local: \"envgen\"
+            local: "envgen"
     YAML
 
-    system bin/\"envgen\", \"check\", \"-c\", \"envgen.yaml\"
-    system bin/\"envgen\", \"pull\", \"-c\", \"envgen.yaml\", \"-e\", \"local\", \"--force\"
-    assert_match \"APP_NAME=envgen\", (testpath/\".env.local\").read
-    assert_match version.to_s, shell_output(\"#{{bin}}/envgen --version\")
+    system bin/"envgen", "check", "-c", "envgen.yaml"
+    system bin/"envgen", "pull", "-c", "envgen.yaml", "-e", "local", "--force"
+    assert_match "APP_NAME=envgen", (testpath/".env.local").read
+    assert_match version.to_s, shell_output("#{bin}/envgen --version")
   end
 end
 """
+)
+
+
+def formula_template(*, source_url: str, sha256: str) -> str:
+    return FORMULA_TEMPLATE.substitute(url=source_url, sha256=sha256)
 
 
 def run_command(
@@ -360,7 +693,7 @@ def do_status(args: argparse.Namespace) -> None:
         print("source_json_exists=false")
 
 
-def do_resolve_source(args: argparse.Namespace) -> None:
+def resolve_source(args: argparse.Namespace) -> dict[str, object]:
     tag = args.tag.strip()
     version = parse_tag(tag)
     source_dir = args.source_dir
@@ -368,36 +701,130 @@ def do_resolve_source(args: argparse.Namespace) -> None:
     tarball_name = f"envgen-{version}.tar.gz"
     download_path = source_dir / tarball_name
 
+    if args.parallel < 1:
+        fail(f"Invalid --parallel value {args.parallel}. Expected 1 or greater")
+
     requested_url = requested_tarball_url(args.source_repo, tag)
-    resolved_url, file_size = download_tarball_with_retries(
-        url=requested_url,
-        destination=download_path,
-        attempts=args.attempts,
-        sleep_seconds=args.sleep_seconds,
+    cached = read_cached_source_metadata(output_json)
+    cache_hit = (
+        cached is not None
+        and cached.get("tag") == tag
+        and cached.get("requested_url") == requested_url
+        and cached.get("download_path") == str(download_path.resolve())
+        and "sha256" in cached
+        and source_cache_is_current(
+            url=requested_url,
+            download_path=download_path,
+            cached=cached,
+        )
     )
 
-    sha256 = sha256_file(download_path)
-    payload: dict[str, object] = {
-        "created_at_utc": dt.datetime.now(dt.UTC).replace(microsecond=0).isoformat(),
-        "download_path": str(download_path.resolve()),
-        "requested_url": requested_url,
-        "resolved_url": resolved_url,
-        "sha256": sha256,
-        "size_bytes": file_size,
-        "source_repo": args.source_repo,
-        "tag": tag,
-        "version": version,
-    }
-    write_json_atomic(output_json, payload)
+    if cache_hit:
+        assert cached is not None
+        payload = cached
+    else:
+        resolved_url, file_size, digests, etag = download_tarball_with_retries(
+            url=requested_url,
+            destination=download_path,
+            attempts=args.attempts,
+            sleep_seconds=args.sleep_seconds,
+            parallel=args.parallel,
+        )
+
+        payload = {
+            "created_at_utc": time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime()),
+            "download_path": str(download_path.resolve()),
+            "mtime_ns": download_path.stat().st_mtime_ns,
+            "requested_url": requested_url,
+            "resolved_url": resolved_url,
+            "size_bytes": file_size,
+            "source_repo": args.source_repo,
+            "tag": tag,
+            "version": version,
+            **digests,
+        }
+        if etag:
+            payload["etag"] = etag
+        write_json_atomic(output_json, payload)
 
     print(f"tag={tag}")
     print(f"version={version}")
     print(f"requested_url={requested_url}")
-    print(f"resolved_url={resolved_url}")
-    print(f"sha256={sha256}")
+    print(f"resolved_url={payload['resolved_url']}")
+    print(f"sha256={payload['sha256']}")
+    print(f"cached={'true' if cache_hit else 'false'}")
     print(f"download_path={download_path.resolve()}")
     print(f"source_json={output_json.resolve()}")
-    emit_next_step("tap-after-source", tag=tag)
+    return payload
+
+
+def do_resolve_source(args: argparse.Namespace) -> None:
+    payload = resolve_source(args)
+    emit_next_step("tap-after-source", tag=str(payload["tag"]))
+
+
+def sync_formula(
+    *,
+    formula_path: Path,
+    source_url: str,
+    sha256: str,
+    dry_run: bool,
+) -> None:
+    new_content = formula_template(source_url=source_url, sha256=sha256)
+
+    old_content = formula_path.read_text(encoding="utf-8") if formula_path.exists() else ""
+    changed = old_content != new_content
+
+    if dry_run:
+        if changed:
+            print(f"[dry-run] write formula: {formula_path}")
+        else:
+            print(f"[dry-run] no formula changes: {formula_path}")
+    elif changed:
+        formula_path.parent.mkdir(parents=True, exist_ok=True)
+        formula_path.write_text(new_content, encoding="utf-8")
+
+    print(f"formula_path={formula_path}")
+    print(f"changed={'true' if changed else 'false'}")
+    print(f"source_url={source_url}")
+    print(f"sha256={sha256}")
+
+
+def do_verify_source(args: argparse.Namespace) -> None:
+    tag = args.tag.strip()
+    parse_tag(tag)
+    source_json = args.source_json or default_source_json_path(tag)
+    metadata = read_source_metadata(source_json)
+    download_path = Path(str(metadata["download_path"]))
+
+    try:
+        actual_size = download_path.stat().st_size
+    except FileNotFoundError:
+        fail(f"Source tarball does not exist: {download_path}")
+    expected_size = metadata.get("size_bytes")
+    if expected_size is not None and actual_size != expected_size:
+        fail(
+            f"Source tarball size mismatch for {download_path}: "
+            f"expected {expected_size}, found {actual_size}"
+        )
+
+    if blake3 is not None and "blake3" in metadata:
+        algorithm = "blake3"
+        actual = blake3_file(download_path)
+    else:
+        algorithm = "sha256"
+        actual = sha256_file(download_path)
+    expected = str(metadata[algorithm])
+    if actual != expected:
+        fail(
+            f"Source tarball {algorithm} mismatch for {download_path}: "
+            f"expected {expected}, found {actual}"
+        )
+
+    print(f"download_path={download_path}")
+    print(f"algorithm={algorithm}")
+    print(f"{algorithm}={actual}")
+    print("verified=true")
 
 
 def do_sync_formula(args: argparse.Namespace) -> None:
@@ -421,41 +848,50 @@ def do_sync_formula(args: argparse.Namespace) -> None:
         source_url = requested_tarball_url(args.source_repo, tag)
         sha256 = args.sha256
 
-    new_content = formula_template(source_url=source_url, sha256=sha256)
+    sync_formula(
+        formula_path=formula_path,
+        source_url=source_url,
+        sha256=sha256,
+        dry_run=args.dry_run,
+    )
 
-    old_content = formula_path.read_text(encoding="utf-8") if formula_path.exists() else ""
-    changed = old_content != new_content
+    emit_next_step(
+        "tap-after-sync",
+        tag=tag,
+        formula_path=str(formula_path),
+    )
 
-    if args.dry_run:
-        if changed:
-            print(f"[dry-run] write formula: {formula_path}")
-        else:
-            print(f"[dry-run] no formula changes: {formula_path}")
-    else:
-        formula_path.parent.mkdir(parents=True, exist_ok=True)
-        formula_path.write_text(new_content, encoding="utf-8")
 
-    print(f"formula_path={formula_path}")
-    print(f"changed={'true' if changed else 'false'}")
-    print(f"source_url={source_url}")
-    print(f"sha256={sha256}")
+def do_release(args: argparse.Namespace) -> None:
+    payload = resolve_source(args)
+    sync_formula(
+        formula_path=args.formula_path,
+        source_url=str(payload["requested_url"]),
+        sha256=str(payload["sha256"]),
+        dry_run=args.dry_run,
+    )
 
     emit_next_step(
         "tap-after-sync",
-        tag=tag,
-        formula_path=str(formula_path),
+        tag=str(payload["tag"]),
+        formula_path=str(args.formula_path),
     )
 
 
+def require_tap_formula(tap_repo_dir: Path, full_formula_path: Path) -> None:
+    try:
+        os.stat(full_formula_path)
+    except (FileNotFoundError, NotADirectoryError):
+        if not tap_repo_dir.is_dir():
+            fail(f"Tap repo directory does not exist: {tap_repo_dir}")
+        fail(f"Formula file does not exist: {full_formula_path}")
+
+
 def do_verify_formula(args: argparse.Namespace) -> None:
     tap_repo_dir = args.tap_repo_dir
-    if not tap_repo_dir.exists():
-        fail(f"Tap repo directory does not exist: {tap_repo_dir}")
-
     formula_path = args.formula_path
     full_formula_path = tap_repo_dir / formula_path
-    if not full_formula_path.exists():
-        fail(f"Formula file does not exist: {full_formula_path}")
+    require_tap_formula(tap_repo_dir, full_formula_path)
 
     if shutil.which("brew") is None:
         fail("`brew` is required for formula verification")
@@ -515,10 +951,7 @@ def do_open_pr(args: argparse.Namespace) -> None:
     formula_path = args.formula_path
     full_formula_path = tap_repo_dir / formula_path
 
-    if not tap_repo_dir.exists():
-        fail(f"Tap repo directory does not exist: {tap_repo_dir}")
-    if not full_formula_path.exists():
-        fail(f"Formula file does not exist: {full_formula_path}")
+    require_tap_formula(tap_repo_dir, full_formula_path)
     if shutil.which("gh") is None:
         fail("`gh` CLI is required to open or update tap pull requests")
 
@@ -536,13 +969,28 @@ def do_open_pr(args: argparse.Namespace) -> None:
         ]
     )
 
-    run_command(["git", "fetch", "origin", args.base_branch], cwd=tap_repo_dir)
-    remote_branch = run_command(
-        ["git", "ls-remote", "--heads", "origin", branch],
+    base_refspec = f"+refs/heads/{args.base_branch}:refs/remotes/origin/{args.base_branch}"
+    # Fetching the PR branch alongside the base doubles as the exists check
+    # (no ls-remote); the fetch fails when the branch is not on origin yet.
+    branch_fetch = run_command(
+        [
+            "git",
+            "fetch",
+            "origin",
+            base_refspec,
+            f"+refs/heads/{branch}:refs/remotes/origin/{branch}",
+        ],
         cwd=tap_repo_dir,
         capture_stdout=True,
+        allow_nonzero=True,
     )
-    branch_exists = bool(remote_branch.stdout.strip())
+    branch_exists = branch_fetch.returncode == 0
+    if not branch_exists:
+        run_command(["git", "fetch", "origin", base_refspec], cwd=tap_repo_dir)
+        run_command(
+            ["git", "update-ref", "-d", f"refs/remotes/origin/{branch}"],
+            cwd=tap_repo_dir,
+        )
     start_ref = f"origin/{branch}" if branch_exists else f"origin/{args.base_branch}"
     run_command(
         ["git", "checkout", "-B", branch, start_ref],
@@ -550,18 +998,24 @@ def do_open_pr(args: argparse.Namespace) -> None:
     )
     run_command(["git", "add", str(formula_path)], cwd=tap_repo_dir)
 
-    staged_diff = run_command(
-        ["git", "diff", "--cached", "--quiet"],
+    commit_result = run_command(
+        ["git", "commit", "--quiet", "-m", f"envgen {version}"],
         cwd=tap_repo_dir,
+        capture_stdout=True,
         allow_nonzero=True,
     )
-    has_changes = staged_diff.returncode != 0
-
-    if has_changes:
-        run_command(
-            ["git", "commit", "-m", f"envgen {version}"],
+    has_changes = commit_result.returncode == 0
+    if not has_changes:
+        staged_diff = run_command(
+            ["git", "diff", "--cached", "--quiet"],
             cwd=tap_repo_dir,
+            allow_nonzero=True,
         )
+        if staged_diff.returncode != 0:
+            details = commit_result.stderr.strip() or commit_result.stdout.strip()
+            fail(f"Command failed: git commit -m envgen {version}\n{details}")
+
+    if has_changes:
         if not args.dry_run:
             run_command(
                 ["git", "push", "--force-with-lease", "origin", branch],
@@ -642,10 +1096,7 @@ def do_next_step(args: argparse.Namespace) -> None:
     )
 
 
-def build_parser() -> argparse.ArgumentParser:
-    parser = argparse.ArgumentParser(description="Manage envgen Homebrew tap release flow")
-    subparsers = parser.add_subparsers(dest="command", required=True)
-
+def add_status_parser(subparsers: argparse._SubParsersAction) -> None:
     status = subparsers.add_parser("status", help="Show Homebrew tap release status for a tag")
     status.add_argument("--tag", required=True)
     status.add_argument("--source-repo", default=DEFAULT_SOURCE_REPO)
@@ -655,6 +1106,8 @@ def build_parser() -> argparse.ArgumentParser:
     status.add_argument("--formula-path", default=DEFAULT_TAP_FORMULA)
     status.set_defaults(func=do_status)
 
+
+def add_resolve_source_parser(subparsers: argparse._SubParsersAction) -> None:
     resolve_source = subparsers.add_parser(
         "resolve-source",
         help="Download and hash GitHub source tarball for a release tag",
@@ -665,8 +1118,21 @@ def build_parser() -> argparse.ArgumentParser:
     resolve_source.add_argument("--out-json", type=Path)
     resolve_source.add_argument("--attempts", type=int, default=5)
     resolve_source.add_argument("--sleep-seconds", type=float, default=3.0)
+    resolve_source.add_argument("--parallel", type=int, default=4)
     resolve_source.set_defaults(func=do_resolve_source)
 
+
+def add_verify_source_parser(subparsers: argparse._SubParsersAction) -> None:
+    verify_source = subparsers.add_parser(
+        "verify-source",
+        help="Re-check the downloaded source tarball against its metadata",
+    )
+    verify_source.add_argument("--tag", required=True)
+    verify_source.add_argument("--source-json", type=Path)
+    verify_source.set_defaults(func=do_verify_source)
+
+
+def add_sync_formula_parser(subparsers: argparse._SubParsersAction) -> None:
     sync_formula = subparsers.add_parser(
         "sync-formula",
         help="Create or update Formula/envgen.rb from source metadata",
@@ -679,6 +1145,25 @@ def build_parser() -> argparse.ArgumentParser:
     sync_formula.add_argument("--dry-run", action="store_true")
     sync_formula.set_defaults(func=do_sync_formula)
 
+
+def add_release_parser(subparsers: argparse._SubParsersAction) -> None:
+    release = subparsers.add_parser(
+        "release",
+        help="Resolve the source tarball and sync the formula in one pass",
+    )
+    release.add_argument("--tag", required=True)
+    release.add_argument("--formula-path", type=Path, required=True)
+    release.add_argument("--source-repo", default=DEFAULT_SOURCE_REPO)
+    release.add_argument("--source-dir", type=Path, default=DEFAULT_SOURCE_DIR)
+    release.add_argument("--out-json", type=Path)
+    release.add_argument("--attempts", type=int, default=5)
+    release.add_argument("--sleep-seconds", type=float, default=3.0)
+    release.add_argument("--parallel", type=int, default=4)
+    release.add_argument("--dry-run", action="store_true")
+    release.set_defaults(func=do_release)
+
+
+def add_verify_formula_parser(subparsers: argparse._SubParsersAction) -> None:
     verify_formula = subparsers.add_parser(
         "verify-formula",
         help="Run brew style/audit/install/test for the tap formula",
@@ -689,6 +1174,8 @@ def build_parser() -> argparse.ArgumentParser:
     verify_formula.add_argument("--formula-path", type=Path, default=Path(DEFAULT_TAP_FORMULA))
     verify_formula.set_defaults(func=do_verify_formula)
 
+
+def add_open_pr_parser(subparsers: argparse._SubParsersAction) -> None:
     open_pr = subparsers.add_parser(
         "open-pr",
         help="Open or update a pull request in the tap repository",
@@ -701,6 +1188,8 @@ def build_parser() -> argparse.ArgumentParser:
     open_pr.add_argument("--dry-run", action="store_true")
     open_pr.set_defaults(func=do_open_pr)
 
+
+def add_next_step_parser(subparsers: argparse._SubParsersAction) -> None:
     next_step = subparsers.add_parser(
         "next-step",
         help="Print guided next-step hints for Homebrew tap flow",
@@ -712,11 +1201,36 @@ def build_parser() -> argparse.ArgumentParser:
     next_step.add_argument("--formula-path", default=DEFAULT_TAP_FORMULA)
     next_step.set_defaults(func=do_next_step)
 
+
+SUBCOMMAND_PARSERS = {
+    "status": add_status_parser,
+    "resolve-source": add_resolve_source_parser,
+    "verify-source": add_verify_source_parser,
+    "sync-formula": add_sync_formula_parser,
+    "release": add_release_parser,
+    "verify-formula": add_verify_formula_parser,
+    "open-pr": add_open_pr_parser,
+    "next-step": add_next_step_parser,
+}
+
+
+def build_parser(command: str | None = None) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Manage envgen Homebrew tap release flow")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    # Build only the requested subcommand; unknown or missing commands get the
+    # full parser so usage errors and --help still list every subcommand.
+    if command in SUBCOMMAND_PARSERS:
+        SUBCOMMAND_PARSERS[command](subparsers)
+    else:
+        for add_parser in SUBCOMMAND_PARSERS.values():
+            add_parser(subparsers)
+
     return parser
 
 
 def main() -> int:
-    parser = build_parser()
+    parser = build_parser(sys.argv[1] if len(sys.argv) > 1 else None)
     args = parser.parse_args()
 
     try:
@@ -7,15 +7,13 @@ This script intentionally separates bumping files from creating/pushing tags.
 from __future__ import annotations
 
 import argparse
-import datetime as dt
-import json
+import functools
 import os
 import re
 import shlex
 import shutil
-import subprocess
 import sys
-import tomllib
+import time
 from pathlib import Path
 
 ROOT = Path(__file__).resolve().parent.parent
@@ -26,7 +24,20 @@ SCHEMA_VERSION_FILE = ROOT / "SCHEMA_VERSION"
 SCHEMA_DIR = ROOT / "schemas"
 
 SEMVER_RE = re.compile(r"^(0|[1-9]\d*)\.(0|[1-9]\d*)\.(0|[1-9]\d*)$")
-UNRELEASED_RE = re.compile(r"(?ms)^## \[Unreleased\]\n(?P<body>.*?)(?=^## |\Z)")
+UNRELEASED_HEADING = "## [Unreleased]\n"
+CHANGELOG_HEADING_RE = re.compile(r"^### (.+)$", flags=re.MULTILINE)
+# A non-blank line that is not a `### Heading` line.
+CHANGELOG_ENTRY_RE = re.compile(r"^(?![^\S\n]*### [^\n]*\S)[^\S\n]*\S", flags=re.MULTILINE)
+PACKAGE_HEADER_RE = re.compile(r"^[ \t]*\[package\][ \t]*\r?$", flags=re.MULTILINE)
+# First `version = "..."` line after [package], without crossing another
+# `[section]` header line. `\r?` keeps CRLF manifests matching.
+PACKAGE_VERSION_RE = re.compile(
+    r"^[ \t]*\[package\][ \t]*\r?$"
+    r"(?:\n(?![ \t]*\[[^\n]*\][ \t]*\r?$)[^\n]*)*?"
+    r'\n[ \t]*version[ \t]*=[ \t]*"(?P<version>[^"\n]+)"',
+    flags=re.MULTILINE,
+)
+SCHEMA_VERSION_FIELD_RE = re.compile(r'("x-envgen-schema-version"\s*:\s*")([^"]+)(")')
 
 CRATE_SECTIONS = ["Added", "Changed", "Deprecated", "Removed", "Fixed", "Security"]
 SCHEMA_SECTIONS = [
@@ -38,6 +49,7 @@ SCHEMA_SECTIONS = [
     "Compatibility",
 ]
 
+
 TRUTHY_ENV_VALUES = {"1", "true", "yes", "on"}
 FALSY_ENV_VALUES = {"", "0", "false", "no", "off"}
 
@@ -56,6 +68,15 @@ RELEASE_WORKFLOW_URL = (
     "https://github.com/smorinlabs/envgen/actions/workflows/release.yml"
 )
 PINNED_RUST_TOOLCHAIN = "1.88.0"
+RELEASE_BRANCH = "main"
+REMOTE_TAG_CACHE_FILE = (
+    Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache")
+    / "envgen"
+    / "remote-tags.json"
+)
+DEFAULT_REMOTE_TAG_CACHE_TTL = 0.0
+
+WRITTEN_TEXT: dict[Path, str] = {}
 
 
 class BumpError(RuntimeError):
@@ -95,98 +116,142 @@ def hints_enabled() -> bool:
     return sys.stdout.isatty()
 
 
-def render_next_step(
-    stage: str,
-    *,
-    crate_version: str | None = None,
-    schema_version: str | None = None,
-    tag_name: str | None = None,
-    lockfile_synced: bool | None = None,
+def next_step_crate_after_bump(
+    *, crate_version: str | None, lockfile_synced: bool | None, **_: object
 ) -> tuple[str, list[str]]:
-    if stage == "crate-after-bump":
-        resolved_crate_version = crate_version or read_cargo_version()
-        lines: list[str] = []
-        if lockfile_synced is True:
-            lines.append("Cargo.lock synchronized for locked checks.")
-        elif lockfile_synced is False:
-            lines.append("Cargo.lock sync runs only in non-dry-run bump mode.")
-        lines.append("$ make check-release")
-        return (
-            f"Crate release prep updated to v{resolved_crate_version}.",
-            lines,
-        )
+    resolved_crate_version = crate_version or read_cargo_version()
+    lines: list[str] = []
+    if lockfile_synced is True:
+        lines.append("Cargo.lock synchronized for locked checks.")
+    elif lockfile_synced is False:
+        lines.append("Cargo.lock sync runs only in non-dry-run bump mode.")
+    lines.append("$ make check-release")
+    return (
+        f"Crate release prep updated to v{resolved_crate_version}.",
+        lines,
+    )
 
-    if stage == "crate-after-check-release":
-        resolved_crate_version = crate_version or read_cargo_version()
-        return (
-            f"Release readiness checks passed for crate v{resolved_crate_version}.",
-            [
-                "$ git add Cargo.toml Cargo.lock CHANGELOG.md",
-                f'$ git commit -m "chore(release): bump crate to v{resolved_crate_version}"',
-                "$ git push origin main",
-                "$ make tag-crate",
-            ],
-        )
 
-    if stage == "crate-after-tag":
-        resolved_crate_version = crate_version or read_cargo_version()
-        resolved_tag_name = tag_name or f"v{resolved_crate_version}"
-        return (
-            f"Local crate tag created: {resolved_tag_name}.",
-            ["$ make push-tag-crate"],
-        )
+def next_step_crate_after_check_release(
+    *, crate_version: str | None, **_: object
+) -> tuple[str, list[str]]:
+    resolved_crate_version = crate_version or read_cargo_version()
+    return (
+        f"Release readiness checks passed for crate v{resolved_crate_version}.",
+        [
+            "$ git add Cargo.toml Cargo.lock CHANGELOG.md",
+            f'$ git commit -m "chore(release): bump crate to v{resolved_crate_version}"',
+            "$ git push origin main",
+            "$ make tag-crate",
+        ],
+    )
 
-    if stage == "crate-after-push-tag":
-        resolved_crate_version = crate_version or read_cargo_version()
-        resolved_tag_name = tag_name or f"v{resolved_crate_version}"
-        return (
-            f"Crate tag pushed to origin: {resolved_tag_name}.",
-            [
-                "Release workflow should trigger automatically from this tag push.",
-                f"Monitor: {RELEASE_WORKFLOW_URL}",
-            ],
-        )
 
-    if stage == "schema-after-bump":
-        resolved_schema_version = schema_version or read_schema_version_file()
-        return (
-            f"Schema release prep updated to v{resolved_schema_version}.",
-            ["$ make check-schema"],
-        )
+def next_step_crate_after_tag(
+    *, crate_version: str | None, tag_name: str | None, **_: object
+) -> tuple[str, list[str]]:
+    resolved_tag_name = tag_name or f"v{crate_version or read_cargo_version()}"
+    return (
+        f"Local crate tag created: {resolved_tag_name}.",
+        ["$ make push-tag-crate"],
+    )
 
-    if stage == "schema-after-check-schema":
-        resolved_schema_version = schema_version or read_schema_version_file()
-        schema_file = f"schemas/envgen.schema.v{resolved_schema_version}.json"
-        return (
-            f"Schema checks passed for artifact v{resolved_schema_version}.",
-            [
-                f"$ git add SCHEMA_VERSION SCHEMA_CHANGELOG.md {schema_file}",
-                f'$ git commit -m "chore(schema): schema-v{resolved_schema_version}"',
-                "$ git push origin main",
-                "$ make tag-schema",
-            ],
-        )
 
-    if stage == "schema-after-tag":
-        resolved_schema_version = schema_version or read_schema_version_file()
-        resolved_tag_name = tag_name or f"schema-v{resolved_schema_version}"
-        return (
-            f"Local schema tag created: {resolved_tag_name}.",
-            ["$ make push-tag-schema"],
-        )
+def next_step_crate_after_push_tag(
+    *, crate_version: str | None, tag_name: str | None, **_: object
+) -> tuple[str, list[str]]:
+    resolved_tag_name = tag_name or f"v{crate_version or read_cargo_version()}"
+    return (
+        f"Crate tag pushed to origin: {resolved_tag_name}.",
+        [
+            "Release workflow should trigger automatically from this tag push.",
+            f"Monitor: {RELEASE_WORKFLOW_URL}",
+        ],
+    )
 
-    if stage == "schema-after-push-tag":
-        resolved_schema_version = schema_version or read_schema_version_file()
-        resolved_tag_name = tag_name or f"schema-v{resolved_schema_version}"
-        return (
-            f"Schema tag pushed to origin: {resolved_tag_name}.",
-            [
-                "Schema tag pushes do not trigger crates.io publishing.",
-                "Create and push a crate tag (vX.Y.Z) when you want a crate release.",
-            ],
-        )
 
-    fail(f"Unsupported next-step stage: {stage}")
+def next_step_schema_after_bump(
+    *, schema_version: str | None, **_: object
+) -> tuple[str, list[str]]:
+    resolved_schema_version = schema_version or read_schema_version_file()
+    return (
+        f"Schema release prep updated to v{resolved_schema_version}.",
+        ["$ make check-schema"],
+    )
+
+
+def next_step_schema_after_check_schema(
+    *, schema_version: str | None, **_: object
+) -> tuple[str, list[str]]:
+    resolved_schema_version = schema_version or read_schema_version_file()
+    schema_file = f"schemas/envgen.schema.v{resolved_schema_version}.json"
+    return (
+        f"Schema checks passed for artifact v{resolved_schema_version}.",
+        [
+            f"$ git add SCHEMA_VERSION SCHEMA_CHANGELOG.md {schema_file}",
+            f'$ git commit -m "chore(schema): schema-v{resolved_schema_version}"',
+            "$ git push origin main",
+            "$ make tag-schema",
+        ],
+    )
+
+
+def next_step_schema_after_tag(
+    *, schema_version: str | None, tag_name: str | None, **_: object
+) -> tuple[str, list[str]]:
+    resolved_tag_name = (
+        tag_name or f"schema-v{schema_version or read_schema_version_file()}"
+    )
+    return (
+        f"Local schema tag created: {resolved_tag_name}.",
+        ["$ make push-tag-schema"],
+    )
+
+
+def next_step_schema_after_push_tag(
+    *, schema_version: str | None, tag_name: str | None, **_: object
+) -> tuple[str, list[str]]:
+    resolved_tag_name = (
+        tag_name or f"schema-v{schema_version or read_schema_version_file()}"
+    )
+    return (
+        f"Schema tag pushed to origin: {resolved_tag_name}.",
+        [
+            "Schema tag pushes do not trigger crates.io publishing.",
+            "Create and push a crate tag (vX.Y.Z) when you want a crate release.",
+        ],
+    )
+
+
+NEXT_STEP_RENDERERS = {
+    "crate-after-bump": next_step_crate_after_bump,
+    "crate-after-check-release": next_step_crate_after_check_release,
+    "crate-after-tag": next_step_crate_after_tag,
+    "crate-after-push-tag": next_step_crate_after_push_tag,
+    "schema-after-bump": next_step_schema_after_bump,
+    "schema-after-check-schema": next_step_schema_after_check_schema,
+    "schema-after-tag": next_step_schema_after_tag,
+    "schema-after-push-tag": next_step_schema_after_push_tag,
+}
+
+
+def render_next_step(
+    stage: str,
+    *,
+    crate_version: str | None = None,
+    schema_version: str | None = None,
+    tag_name: str | None = None,
+    lockfile_synced: bool | None = None,
+) -> tuple[str, list[str]]:
+    renderer = NEXT_STEP_RENDERERS.get(stage)
+    if renderer is None:
+        fail(f"Unsupported next-step stage: {stage}")
+    return renderer(
+        crate_version=crate_version,
+        schema_version=schema_version,
+        tag_name=tag_name,
+        lockfile_synced=lockfile_synced,
+    )
 
 
 def emit_next_step(
@@ -214,10 +279,49 @@ def emit_next_step(
         print(f"  {line}")
 
 
-def write_atomic(path: Path, content: str) -> None:
+@functools.lru_cache(maxsize=None)
+def read_text_cached(path: Path, mtime_ns: int, size: int) -> str:
+    return path.read_text(encoding="utf-8")
+
+
+def read_text(path: Path) -> str:
+    written = WRITTEN_TEXT.get(path)
+    if written is not None:
+        return written
+    stat = path.stat()
+    return read_text_cached(path, stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=None)
+def parse_cargo_manifest(mtime_ns: int, size: int) -> dict[str, object]:
+    import tomllib
+
+    return tomllib.loads(read_text_cached(CARGO_TOML, mtime_ns, size))
+
+
+def load_cargo_manifest() -> dict[str, object]:
+    stat = CARGO_TOML.stat()
+    return parse_cargo_manifest(stat.st_mtime_ns, stat.st_size)
+
+
+def write_atomic(path: Path, content: str | bytes) -> None:
+    data = content.encode("utf-8") if isinstance(content, str) else content
     tmp_path = path.with_suffix(path.suffix + ".tmp")
-    tmp_path.write_text(content, encoding="utf-8")
-    tmp_path.replace(path)
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view) :]
+    finally:
+        os.close(fd)
+    os.replace(tmp_path, path)
+    if isinstance(content, str):
+        WRITTEN_TEXT[path] = content
+    else:
+        WRITTEN_TEXT.pop(path, None)
+    # A rewrite can land within the same mtime tick at the same size.
+    read_text_cached.cache_clear()
+    parse_cargo_manifest.cache_clear()
 
 
 def validate_semver(version: str) -> str:
@@ -257,56 +361,53 @@ def resolve_next_version(current: str, level: str | None, version: str | None) -
 
 
 def read_cargo_version() -> str:
-    with CARGO_TOML.open("rb") as fh:
-        parsed = tomllib.load(fh)
+    parsed = load_cargo_manifest()
     version = parsed.get("package", {}).get("version")
     if not version:
         fail("Could not read [package].version from Cargo.toml")
     return validate_semver(version)
 
 
+def find_package_version(text: str) -> re.Match[str]:
+    package_header = PACKAGE_HEADER_RE.search(text)
+    if package_header is None:
+        fail("[package] section not found in Cargo.toml")
+    version_match = PACKAGE_VERSION_RE.match(text, package_header.start())
+    if version_match is None:
+        fail("version entry not found in [package] section of Cargo.toml")
+    return version_match
+
+
+def read_cargo_version_fast() -> str:
+    text = read_text(CARGO_TOML)
+    return validate_semver(find_package_version(text).group("version"))
+
+
 def update_cargo_version(new_version: str, dry_run: bool) -> tuple[str, str]:
+    validate_semver(new_version)
     old_version = read_cargo_version()
     if old_version == new_version:
         fail("New crate version matches current version; nothing to do")
 
-    text = CARGO_TOML.read_text(encoding="utf-8")
-    lines = text.splitlines(keepends=True)
+    text = read_text(CARGO_TOML)
+    version_match = find_package_version(text)
 
-    package_start = None
-    for index, line in enumerate(lines):
-        if line.strip() == "[package]":
-            package_start = index
-            break
-    if package_start is None:
-        fail("[package] section not found in Cargo.toml")
-
-    version_index = None
-    version_match = None
-    for index in range(package_start + 1, len(lines)):
-        stripped = lines[index].strip()
-        if stripped.startswith("[") and stripped.endswith("]"):
-            break
-        match = re.match(
-            r'^(\s*version\s*=\s*")([^"]+)(".*?)(\r?\n?)$',
-            lines[index],
-        )
-        if match:
-            version_index = index
-            version_match = match
-            break
-    if version_index is None or version_match is None:
-        fail("version entry not found in [package] section of Cargo.toml")
-
-    lines[version_index] = (
-        f"{version_match.group(1)}{new_version}{version_match.group(3)}"
-        f"{version_match.group(4)}"
+    # Only the quoted value changes and new_version is strict semver, so the
+    # manifest stays valid TOML without a second full parse.
+    updated = (
+        text[: version_match.start("version")]
+        + new_version
+        + text[version_match.end("version") :]
     )
-    updated = "".join(lines)
-    try:
-        tomllib.loads(updated)
-    except tomllib.TOMLDecodeError as exc:
-        fail(f"Generated invalid Cargo.toml while updating version: {exc}")
+    if env_var_truthy("ENVGEN_STRICT_TOML_CHECK"):
+        import tomllib
+
+        try:
+            parsed = tomllib.loads(updated)
+        except tomllib.TOMLDecodeError as exc:
+            fail(f"Updated Cargo.toml is invalid TOML: {exc}")
+        if parsed.get("package", {}).get("version") != new_version:
+            fail("Updated Cargo.toml does not carry the new [package].version")
 
     if dry_run:
         print(f"[dry-run] update {CARGO_TOML} version {old_version} -> {new_version}")
@@ -317,18 +418,43 @@ def update_cargo_version(new_version: str, dry_run: bool) -> tuple[str, str]:
 
 
 def read_schema_version_file() -> str:
-    if not SCHEMA_VERSION_FILE.exists():
+    try:
+        version = read_text(SCHEMA_VERSION_FILE).strip()
+    except FileNotFoundError:
+        fail(f"Missing schema version file: {SCHEMA_VERSION_FILE}")
+    return validate_semver(version)
+
+
+def read_schema_version_file_fast() -> str:
+    try:
+        version = SCHEMA_VERSION_FILE.read_bytes().strip().decode("ascii")
+    except FileNotFoundError:
         fail(f"Missing schema version file: {SCHEMA_VERSION_FILE}")
-    version = SCHEMA_VERSION_FILE.read_text(encoding="utf-8").strip()
+    except UnicodeDecodeError:
+        fail(f"Invalid version in {SCHEMA_VERSION_FILE}. Expected strict semver X.Y.Z")
     return validate_semver(version)
 
 
+def load_json_text(text: str) -> object:
+    import json
+
+    try:
+        import orjson
+    except ModuleNotFoundError:
+        return json.loads(text)
+    # orjson.JSONDecodeError subclasses json.JSONDecodeError.
+    return orjson.loads(text)
+
+
 def update_schema_changelog_version(
     schema_json_text: str,
     new_version: str,
+    full_json_validate: bool = False,
 ) -> str:
-    updated, count = re.subn(
-        r'("x-envgen-schema-version"\s*:\s*")([^"]+)(")',
+    # A strict semver value cannot contain '"', '\\' or control characters, so
+    # replacing the quoted field value cannot break the surrounding JSON.
+    validate_semver(new_version)
+    updated, count = SCHEMA_VERSION_FIELD_RE.subn(
         lambda match: f"{match.group(1)}{new_version}{match.group(3)}",
         schema_json_text,
         count=1,
@@ -336,22 +462,43 @@ def update_schema_changelog_version(
     if count != 1:
         fail('Schema JSON does not contain exactly one "x-envgen-schema-version" field')
 
-    try:
-        json.loads(updated)
-    except json.JSONDecodeError as exc:
-        fail(f"Updated schema JSON is invalid: {exc}")
+    if full_json_validate:
+        import json
+
+        try:
+            load_json_text(updated)
+        except json.JSONDecodeError as exc:
+            fail(f"Updated schema JSON is invalid: {exc}")
     return updated
 
 
+def render_unreleased_block(headings: list[str]) -> str:
+    block = "## [Unreleased]\n\n" + "".join(f"### {heading}\n\n" for heading in headings)
+    return block.rstrip() + "\n"
+
+
+DEFAULT_UNRELEASED_BLOCKS = {
+    tuple(sections): render_unreleased_block(sections)
+    for sections in (CRATE_SECTIONS, SCHEMA_SECTIONS)
+}
+
+
 def changelog_has_entries(body: str) -> bool:
-    for line in body.splitlines():
-        stripped = line.strip()
-        if not stripped:
-            continue
-        if stripped.startswith("### "):
-            continue
-        return True
-    return False
+    return CHANGELOG_ENTRY_RE.search(body) is not None
+
+
+def find_unreleased_section(text: str) -> tuple[int, int, int] | None:
+    if text.startswith(UNRELEASED_HEADING):
+        start = 0
+    else:
+        start = text.find("\n" + UNRELEASED_HEADING) + 1
+        if start == 0:
+            return None
+    body_start = start + len(UNRELEASED_HEADING)
+    if text.startswith("## ", body_start):
+        return start, body_start, body_start
+    end = text.find("\n## ", body_start) + 1
+    return start, body_start, end or len(text)
 
 
 def rotate_changelog(
@@ -361,14 +508,17 @@ def rotate_changelog(
     allow_empty: bool,
     dry_run: bool,
     make_override_command: str | None = None,
-) -> None:
-    text = path.read_text(encoding="utf-8")
-    match = UNRELEASED_RE.search(text)
-    if not match:
+) -> str:
+    import datetime as dt
+
+    text = read_text(path)
+    section = find_unreleased_section(text)
+    if section is None:
         fail(f"Missing '## [Unreleased]' section in {path}")
 
-    body = match.group("body")
-    headings = re.findall(r"^### (.+)$", body, flags=re.MULTILINE)
+    start, body_start, end = section
+    body = text[body_start:end]
+    headings = CHANGELOG_HEADING_RE.findall(body)
     if not headings:
         headings = default_sections
 
@@ -381,43 +531,162 @@ def rotate_changelog(
             )
         fail(f"Unreleased section in {path} has no entries.")
 
-    unreleased_block = "## [Unreleased]\n\n"
-    unreleased_block += "".join(f"### {heading}\n\n" for heading in headings)
-    unreleased_block = unreleased_block.rstrip() + "\n"
+    unreleased_block = DEFAULT_UNRELEASED_BLOCKS.get(tuple(headings))
+    if unreleased_block is None:
+        unreleased_block = render_unreleased_block(headings)
 
     clean_body = body.strip("\n")
-    release_block = f"## [{new_version}] - {dt.date.today().isoformat()}\n\n"
+    parts = [
+        text[:start],
+        unreleased_block,
+        "\n",
+        f"## [{new_version}] - {dt.date.today().isoformat()}\n\n",
+    ]
     if clean_body:
-        release_block += clean_body + "\n"
-    release_block += "\n"
-
-    replacement = unreleased_block + "\n" + release_block
-    updated = text[: match.start()] + replacement + text[match.end() :]
+        parts += (clean_body, "\n")
+    parts += ("\n", text[end:])
+    updated = "".join(parts)
 
     if dry_run:
         print(f"[dry-run] rotate changelog section in {path} for {new_version}")
     else:
         write_atomic(path, updated)
+    return updated
 
 
 def validate_release_section(path: Path, version: str) -> None:
-    pattern = re.compile(rf"^## \[{re.escape(version)}\] - ", flags=re.MULTILINE)
-    if not pattern.search(path.read_text(encoding="utf-8")):
+    heading = f"## [{version}] - "
+    text = read_text(path)
+    if not text.startswith(heading) and f"\n{heading}" not in text:
         fail(f"Missing release section '## [{version}] - YYYY-MM-DD' in {path}")
 
 
+def remote_tag_cache_ttl() -> float:
+    value = os.environ.get("ENVGEN_REMOTE_TAG_CACHE_TTL")
+    if value is None:
+        return DEFAULT_REMOTE_TAG_CACHE_TTL
+    try:
+        return float(value)
+    except ValueError:
+        return DEFAULT_REMOTE_TAG_CACHE_TTL
+
+
+def read_remote_tag_cache(origin_url: str) -> set[str] | None:
+    import json
+
+    if not origin_url or remote_tag_cache_ttl() <= 0:
+        return None
+    try:
+        entry = json.loads(REMOTE_TAG_CACHE_FILE.read_bytes()).get(origin_url)
+    except (OSError, ValueError, AttributeError):
+        return None
+    if not isinstance(entry, dict):
+        return None
+    fetched_at = entry.get("fetched_at")
+    tags = entry.get("tags")
+    if not isinstance(fetched_at, (int, float)) or not isinstance(tags, list):
+        return None
+    if time.time() - fetched_at > remote_tag_cache_ttl():
+        return None
+    return set(tags)
+
+
+def write_remote_tag_cache(origin_url: str, tags: set[str]) -> None:
+    import json
+
+    if not origin_url or remote_tag_cache_ttl() <= 0:
+        return
+    try:
+        entries = json.loads(REMOTE_TAG_CACHE_FILE.read_bytes())
+    except (OSError, ValueError):
+        entries = {}
+    if not isinstance(entries, dict):
+        entries = {}
+    entries[origin_url] = {"fetched_at": time.time(), "tags": sorted(tags)}
+    try:
+        REMOTE_TAG_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(REMOTE_TAG_CACHE_FILE, json.dumps(entries) + "\n")
+    except OSError:
+        pass
+
+
+class RepoState:
+    """Git refs loaded once per run; tag lookups are answered from these sets."""
+
+    @functools.cached_property
+    def local_tags(self) -> set[str]:
+        import subprocess
+
+        result = subprocess.run(
+            ["git", "for-each-ref", "--format=%(refname:strip=2)", "refs/tags"],
+            cwd=ROOT,
+            text=True,
+            capture_output=True,
+            check=False,
+        )
+        if result.returncode != 0:
+            fail(
+                "Failed to list local tags: "
+                f"{result.stderr.strip() or 'unknown git error'}"
+            )
+        return set(result.stdout.split())
+
+    @functools.cached_property
+    def origin_url(self) -> str:
+        import subprocess
+
+        result = subprocess.run(
+            ["git", "config", "--get", "remote.origin.url"],
+            cwd=ROOT,
+            text=True,
+            capture_output=True,
+            check=False,
+        )
+        return result.stdout.strip()
+
+    @functools.cached_property
+    def remote_tags(self) -> set[str]:
+        import subprocess
+
+        cached = read_remote_tag_cache(self.origin_url)
+        if cached is not None:
+            return cached
+        result = subprocess.run(
+            ["git", "ls-remote", "--tags", "--refs", "origin"],
+            cwd=ROOT,
+            text=True,
+            capture_output=True,
+            check=False,
+        )
+        if result.returncode != 0:
+            fail(
+                "Failed to query remote tags on origin: "
+                f"{result.stderr.strip() or 'unknown git error'}"
+            )
+        tags: set[str] = set()
+        for line in result.stdout.splitlines():
+            _, _, ref = line.partition("\t")
+            tags.add(ref.removeprefix("refs/tags/"))
+        write_remote_tag_cache(self.origin_url, tags)
+        return tags
+
+
+REPO_STATE = RepoState()
+
+
 def local_tag_exists(tag_name: str) -> bool:
-    result = subprocess.run(
-        ["git", "show-ref", "--verify", "--quiet", f"refs/tags/{tag_name}"],
-        cwd=ROOT,
-        check=False,
-    )
-    return result.returncode == 0
+    return tag_name in REPO_STATE.local_tags
 
 
 def remote_tag_exists(tag_name: str) -> bool:
+    return tag_name in REPO_STATE.remote_tags
+
+
+def git_output(args: list[str]) -> str:
+    import subprocess
+
     result = subprocess.run(
-        ["git", "ls-remote", "--tags", "origin", f"refs/tags/{tag_name}"],
+        ["git", *args],
         cwd=ROOT,
         text=True,
         capture_output=True,
@@ -425,21 +694,55 @@ def remote_tag_exists(tag_name: str) -> bool:
     )
     if result.returncode != 0:
         fail(
-            f"Failed to query remote tags for '{tag_name}': "
+            f"Command failed: {shlex.join(['git', *args])}\n"
             f"{result.stderr.strip() or 'unknown git error'}"
         )
-    return bool(result.stdout.strip())
+    return result.stdout
+
+
+def require_release_branch() -> None:
+    branch = git_output(["rev-parse", "--abbrev-ref", "HEAD"]).strip()
+    if branch != RELEASE_BRANCH:
+        fail(
+            f"Release commands must run on '{RELEASE_BRANCH}' "
+            f"(current branch: {branch}). The release tag is created on HEAD."
+        )
+
+
+def tracked_files(*pathspecs: str) -> list[str]:
+    return git_output(["ls-files", "--", *pathspecs]).splitlines()
 
 
 def run_git_command(args: list[str], dry_run: bool) -> None:
-    quoted = shlex.join(["git", *args])
+    import subprocess
+
+    argv = ["git", *args]
+    if dry_run:
+        print(f"[dry-run] {shlex.join(argv)}")
+        return
+
+    result = subprocess.run(argv, cwd=ROOT, check=False)
+    if result.returncode != 0:
+        fail(f"Command failed: {shlex.join(argv)}")
+
+
+def run_git_script(commands: list[list[str]], dry_run: bool) -> None:
+    import subprocess
+
+    quoted = [shlex.join(["git", *args]) for args in commands]
     if dry_run:
-        print(f"[dry-run] {quoted}")
+        for command in quoted:
+            print(f"[dry-run] {command}")
         return
 
-    result = subprocess.run(["git", *args], cwd=ROOT, check=False)
+    script = "\n".join(
+        f"{command} || exit {index}" for index, command in enumerate(quoted, start=1)
+    )
+    result = subprocess.run(["sh", "-c", script], cwd=ROOT, check=False)
     if result.returncode != 0:
-        fail(f"Command failed: {quoted}")
+        if 1 <= result.returncode <= len(quoted):
+            fail(f"Command failed: {quoted[result.returncode - 1]}")
+        fail(f"Command failed: sh -c {shlex.quote(script)}")
 
 
 def lockfile_sync_command_candidates() -> list[list[str]]:
@@ -471,27 +774,28 @@ def lockfile_sync_command_candidates() -> list[list[str]]:
 
 
 def sync_cargo_lockfile(dry_run: bool) -> None:
+    import subprocess
+
     commands = lockfile_sync_command_candidates()
-    command = shlex.join(commands[0])
     if dry_run:
-        print(f"[dry-run] would run: {command}")
+        print(f"[dry-run] would run: {shlex.join(commands[0])}")
         if len(commands) > 1:
             print(f"[dry-run] fallback command: {shlex.join(commands[1])}")
         return
 
     failures: list[str] = []
     for index, args in enumerate(commands):
-        quoted = shlex.join(args)
         if index > 0:
             print(
-                f"WARNING: lockfile sync failed; retrying with fallback: {quoted}",
+                "WARNING: lockfile sync failed; retrying with fallback: "
+                f"{shlex.join(args)}",
                 file=sys.stderr,
             )
 
         result = subprocess.run(args, cwd=ROOT, check=False)
         if result.returncode == 0:
             return
-        failures.append(f"{quoted} (exit {result.returncode})")
+        failures.append(f"{shlex.join(args)} (exit {result.returncode})")
 
     fail(
         "Failed to synchronize Cargo.lock after crate version bump.\n"
@@ -504,14 +808,53 @@ def create_tag(tag_name: str, message: str, dry_run: bool) -> None:
     if local_tag_exists(tag_name):
         fail(f"Local tag already exists: {tag_name}")
     run_git_command(["tag", "-a", tag_name, "-m", message], dry_run)
+    if not dry_run:
+        REPO_STATE.local_tags.add(tag_name)
 
 
 def push_tag(tag_name: str, dry_run: bool) -> None:
-    if not local_tag_exists(tag_name):
-        fail(f"Local tag does not exist: {tag_name}. Create it first.")
-    if remote_tag_exists(tag_name):
-        fail(f"Remote tag already exists on origin: {tag_name}")
+    import concurrent.futures
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        local_future = executor.submit(local_tag_exists, tag_name)
+        remote_future = executor.submit(remote_tag_exists, tag_name)
+        if not local_future.result():
+            fail(f"Local tag does not exist: {tag_name}. Create it first.")
+        if remote_future.result():
+            fail(f"Remote tag already exists on origin: {tag_name}")
     run_git_command(["push", "origin", f"refs/tags/{tag_name}"], dry_run)
+    if not dry_run:
+        REPO_STATE.remote_tags.add(tag_name)
+        write_remote_tag_cache(REPO_STATE.origin_url, REPO_STATE.remote_tags)
+
+
+def tag_and_push(
+    tag_name: str,
+    message: str,
+    dry_run: bool,
+    preceding_commands: tuple[list[str], ...] = (),
+) -> None:
+    import concurrent.futures
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        local_future = executor.submit(local_tag_exists, tag_name)
+        remote_future = executor.submit(remote_tag_exists, tag_name)
+        if local_future.result():
+            fail(f"Local tag already exists: {tag_name}")
+        if remote_future.result():
+            fail(f"Remote tag already exists on origin: {tag_name}")
+    run_git_script(
+        [
+            *preceding_commands,
+            ["tag", "-a", tag_name, "-m", message],
+            ["push", "origin", f"refs/tags/{tag_name}"],
+        ],
+        dry_run,
+    )
+    if not dry_run:
+        REPO_STATE.local_tags.add(tag_name)
+        REPO_STATE.remote_tags.add(tag_name)
+        write_remote_tag_cache(REPO_STATE.origin_url, REPO_STATE.remote_tags)
 
 
 def resolve_tag_crate_version(*, require_release_section: bool) -> str:
@@ -546,15 +889,31 @@ def resolve_tag_schema_version(*, require_release_section: bool) -> str:
     return resolved
 
 
-def do_status(_args: argparse.Namespace) -> None:
-    crate_version = read_cargo_version()
-    schema_version = read_schema_version_file()
-    schema_path = SCHEMA_DIR / f"envgen.schema.v{schema_version}.json"
+@functools.lru_cache(maxsize=1)
+def scan_schema_dir() -> frozenset[str]:
+    try:
+        with os.scandir(SCHEMA_DIR) as entries:
+            return frozenset(entry.name for entry in entries)
+    except FileNotFoundError:
+        return frozenset()
+
+
+def do_status(args: argparse.Namespace) -> None:
+    if args.fast:
+        crate_version = read_cargo_version_fast()
+        schema_version = read_schema_version_file_fast()
+        schema_path = SCHEMA_DIR / f"envgen.schema.v{schema_version}.json"
+        schema_exists = os.path.lexists(schema_path)
+    else:
+        crate_version = read_cargo_version()
+        schema_version = read_schema_version_file()
+        schema_path = SCHEMA_DIR / f"envgen.schema.v{schema_version}.json"
+        schema_exists = schema_path.exists()
 
     print(f"crate_version={crate_version}")
     print(f"schema_version={schema_version}")
     print(f"schema_file={schema_path}")
-    print(f"schema_file_exists={'yes' if schema_path.exists() else 'no'}")
+    print(f"schema_file_exists={'yes' if schema_exists else 'no'}")
 
 
 def do_bump_crate(args: argparse.Namespace) -> None:
@@ -618,14 +977,16 @@ def do_bump_schema(args: argparse.Namespace) -> None:
     old_schema_path = SCHEMA_DIR / f"envgen.schema.v{old}.json"
     new_schema_path = SCHEMA_DIR / f"envgen.schema.v{new}.json"
 
-    if not old_schema_path.exists():
+    schema_files = scan_schema_dir()
+    if old_schema_path.name not in schema_files:
         fail(f"Current schema file does not exist: {old_schema_path}")
-    if new_schema_path.exists():
+    if new_schema_path.name in schema_files:
         fail(f"Target schema file already exists: {new_schema_path}")
 
     updated_schema = update_schema_changelog_version(
         old_schema_path.read_text(encoding="utf-8"),
         new,
+        full_json_validate=args.full_json_validate,
     )
 
     rotate_changelog(
@@ -642,8 +1003,9 @@ def do_bump_schema(args: argparse.Namespace) -> None:
         print(f"[dry-run] remove schema file: {old_schema_path}")
         print(f"[dry-run] update {SCHEMA_VERSION_FILE} -> {new}")
     else:
-        write_atomic(new_schema_path, updated_schema)
+        write_atomic(new_schema_path, updated_schema.encode("utf-8"))
         old_schema_path.unlink()
+        scan_schema_dir.cache_clear()
         write_atomic(SCHEMA_VERSION_FILE, f"{new}\n")
 
     print(f"schema version: {old} -> {new}")
@@ -669,6 +1031,43 @@ def do_push_tag_crate(args: argparse.Namespace) -> None:
     emit_next_step("crate-after-push-tag", crate_version=version, tag_name=tag_name)
 
 
+def do_tag_and_push_crate(args: argparse.Namespace) -> None:
+    version = resolve_tag_crate_version(require_release_section=True)
+    tag_name = f"v{version}"
+    tag_and_push(tag_name, f"release {tag_name}", args.dry_run)
+    print(f"created local tag: {tag_name}")
+    print(f"pushed tag: {tag_name}")
+    emit_next_step("crate-after-push-tag", crate_version=version, tag_name=tag_name)
+
+
+def do_release_crate(args: argparse.Namespace) -> None:
+    version = resolve_tag_crate_version(require_release_section=True)
+    tag_name = f"v{version}"
+    require_release_branch()
+    # Cargo.lock is only part of the release commit when the repo tracks it.
+    release_paths = ["Cargo.toml", "CHANGELOG.md", *tracked_files("Cargo.lock")]
+    tag_and_push(
+        tag_name,
+        f"release {tag_name}",
+        args.dry_run,
+        (
+            [
+                "commit",
+                "--only",
+                "-m",
+                f"chore(release): bump crate to {tag_name}",
+                "--",
+                *release_paths,
+            ],
+            ["push", "origin", RELEASE_BRANCH],
+        ),
+    )
+    print(f"committed release files for crate {tag_name}")
+    print(f"created local tag: {tag_name}")
+    print(f"pushed tag: {tag_name}")
+    emit_next_step("crate-after-push-tag", crate_version=version, tag_name=tag_name)
+
+
 def do_tag_schema(args: argparse.Namespace) -> None:
     version = resolve_tag_schema_version(require_release_section=True)
     tag_name = f"schema-v{version}"
@@ -685,6 +1084,41 @@ def do_push_tag_schema(args: argparse.Namespace) -> None:
     emit_next_step("schema-after-push-tag", schema_version=version, tag_name=tag_name)
 
 
+def do_release_schema(args: argparse.Namespace) -> None:
+    version = resolve_tag_schema_version(require_release_section=True)
+    tag_name = f"schema-v{version}"
+    require_release_branch()
+    schema_file = f"schemas/envgen.schema.v{version}.json"
+    removed_schema_files = [
+        path
+        for path in tracked_files("schemas/envgen.schema.v*.json")
+        if path != schema_file and not (ROOT / path).exists()
+    ]
+    release_paths = ["SCHEMA_VERSION", "SCHEMA_CHANGELOG.md", schema_file]
+    tag_and_push(
+        tag_name,
+        f"schema release {tag_name}",
+        args.dry_run,
+        (
+            ["add", "--", schema_file, *removed_schema_files],
+            [
+                "commit",
+                "--only",
+                "-m",
+                f"chore(schema): {tag_name}",
+                "--",
+                *release_paths,
+                *removed_schema_files,
+            ],
+            ["push", "origin", RELEASE_BRANCH],
+        ),
+    )
+    print(f"committed release files for {tag_name}")
+    print(f"created local tag: {tag_name}")
+    print(f"pushed tag: {tag_name}")
+    emit_next_step("schema-after-push-tag", schema_version=version, tag_name=tag_name)
+
+
 def do_next_step(args: argparse.Namespace) -> None:
     emit_next_step(args.stage)
 
@@ -694,6 +1128,7 @@ def build_parser() -> argparse.ArgumentParser:
     subparsers = parser.add_subparsers(dest="command", required=True)
 
     status = subparsers.add_parser("status", help="Show current crate/schema versions")
+    status.add_argument("--fast", action="store_true")
     status.set_defaults(func=do_status)
 
     next_step = subparsers.add_parser(
@@ -716,6 +1151,7 @@ def build_parser() -> argparse.ArgumentParser:
     bump_schema.add_argument("--level", choices=["patch", "minor", "major"])
     bump_schema.add_argument("--version")
     bump_schema.add_argument("--allow-empty-changelog", action="store_true")
+    bump_schema.add_argument("--full-json-validate", action="store_true")
     bump_schema.add_argument("--dry-run", action="store_true")
     bump_schema.set_defaults(func=do_bump_schema)
 
@@ -729,6 +1165,19 @@ def build_parser() -> argparse.ArgumentParser:
     push_tag_crate.add_argument("--dry-run", action="store_true")
     push_tag_crate.set_defaults(func=do_push_tag_crate)
 
+    tag_and_push_crate = subparsers.add_parser(
+        "tag-and-push-crate", help="Create crate tag and push it to origin"
+    )
+    tag_and_push_crate.add_argument("--dry-run", action="store_true")
+    tag_and_push_crate.set_defaults(func=do_tag_and_push_crate)
+
+    release_crate = subparsers.add_parser(
+        "release-crate",
+        help="Commit checked crate release files, push main, then tag and push",
+    )
+    release_crate.add_argument("--dry-run", action="store_true")
+    release_crate.set_defaults(func=do_release_crate)
+
     tag_schema = subparsers.add_parser("tag-schema", help="Create local annotated schema tag")
     tag_schema.add_argument("--dry-run", action="store_true")
     tag_schema.set_defaults(func=do_tag_schema)
@@ -739,6 +1188,13 @@ def build_parser() -> argparse.ArgumentParser:
     push_tag_schema.add_argument("--dry-run", action="store_true")
     push_tag_schema.set_defaults(func=do_push_tag_schema)
 
+    release_schema = subparsers.add_parser(
+        "release-schema",
+        help="Commit checked schema release files, push main, then tag and push",
+    )
+    release_schema.add_argument("--dry-run", action="store_true")
+    release_schema.set_defaults(func=do_release_schema)
+
     return parser
 
 